@@ -12,57 +12,34 @@ Author: adapted for tests by ChatGPT (for Blas Truden)
 Based on original script: main.py. :contentReference[oaicite:1]{index=1}
 """
 
-import struct
-import serial
-import serial.tools.list_ports
+import argparse
 from datetime import datetime
-from time import time
+from time import time_ns
 from random import randint
 from uart_proto import uart_pb2  # generated protobuf (same as your original)
 from logger_util import log_message
-
-# === Configuration constants ===
-BAUDRATE = 115200
-TIMEOUT = 1.0
-MAX_MESSAGE_LENGTH = 128  # used for normal mode; tests can exceed if needed
-
-# Frame bytes
-SOF = b'\x02'
-EOF = b'\x03'
-
-
-def crc16_ibm(data: bytes) -> int:
-    crc = 0xFFFF
-    for byte in data:
-        crc ^= byte
-        for _ in range(8):
-            if crc & 1:
-                crc = (crc >> 1) ^ 0xA001
-            else:
-                crc >>= 1
-    return crc & 0xFFFF
-
-
-def frame_message(payload: bytes) -> bytes:
-    """Normal/valid framed message."""
-    length_bytes = struct.pack(">H", len(payload))
-    crc_bytes = struct.pack(">H", crc16_ibm(payload))
-    return SOF + length_bytes + payload + crc_bytes + EOF
+from uart_frame import (
+    assemble_frame,
+    configure_console_logging,
+    crc16_ibm,
+    frame_message,
+    open_serial_connection,
+    seal_frame,
+    select_port,
+    send_batch,
+    write_frame,
+)
 
 
 # ---------- Malformed frame builders (tests) ----------
 def frame_missing_sof(payload: bytes) -> bytes:
     """Drop SOF, send rest normally."""
-    length_bytes = struct.pack(">H", len(payload))
-    crc_bytes = struct.pack(">H", crc16_ibm(payload))
-    return length_bytes + payload + crc_bytes + EOF
+    return frame_message(payload)[1:]
 
 
 def frame_missing_eof(payload: bytes) -> bytes:
     """Drop EOF, send rest normally."""
-    length_bytes = struct.pack(">H", len(payload))
-    crc_bytes = struct.pack(">H", crc16_ibm(payload))
-    return SOF + length_bytes + payload + crc_bytes
+    return frame_message(payload)[:-1]
 
 
 def frame_wrong_length_field(payload: bytes) -> bytes:
@@ -70,19 +47,15 @@ def frame_wrong_length_field(payload: bytes) -> bytes:
     # introduce a random delta between -3 and +7 but keep unsigned 16-bit
     delta = randint(-3, 7)
     fake_len = (len(payload) + delta) & 0xFFFF
-    length_bytes = struct.pack(">H", fake_len)
-    crc_bytes = struct.pack(">H", crc16_ibm(payload))
-    return SOF + length_bytes + payload + crc_bytes + EOF
+    return assemble_frame(fake_len, payload, crc16_ibm(payload))
 
 
 def frame_wrong_crc(payload: bytes) -> bytes:
     """Corrupt CRC bytes (flip some bits)."""
-    length_bytes = struct.pack(">H", len(payload))
     good_crc = crc16_ibm(payload)
     # flip some bits to make CRC wrong
     bad_crc = good_crc ^ 0xA5A5
-    crc_bytes = struct.pack(">H", bad_crc & 0xFFFF)
-    return SOF + length_bytes + payload + crc_bytes + EOF
+    return assemble_frame(len(payload), payload, bad_crc & 0xFFFF)
 
 
 def frame_payload_length_mismatch(payload: bytes) -> bytes:
@@ -91,100 +64,65 @@ def frame_payload_length_mismatch(payload: bytes) -> bytes:
     For example: length set to len(payload) + 5 but only send original payload.
     """
     fake_len = (len(payload) + 5) & 0xFFFF
-    length_bytes = struct.pack(">H", fake_len)
-    crc_bytes = struct.pack(">H", crc16_ibm(payload))
-    return SOF + length_bytes + payload + crc_bytes + EOF
+    return assemble_frame(fake_len, payload, crc16_ibm(payload))
+
+
+_FILLER = b'A' * 64  # filler pattern for frame_payload_too_high
 
 
-def frame_payload_too_high(payload: bytes = None, target_length: int = 600) -> bytes:
+def frame_payload_too_high(payload: bytes = None, target_length: int = 600) -> bytearray:
     """
     Build a frame with a very large payload (e.g., 600 bytes).
     If a payload is provided it will be repeated or padded to reach target_length.
     Otherwise filler bytes are used.
     """
-    if payload:
-        # repeat the serialized payload until we reach or exceed target_length, then cut
-        rep = (target_length + len(payload) - 1) // len(payload)
-        big_payload = (payload * rep)[:target_length]
-    else:
-        big_payload = b'A' * target_length
-
-    length_bytes = struct.pack(">H", len(big_payload))
-    crc_bytes = struct.pack(">H", crc16_ibm(big_payload))
-    return SOF + length_bytes + big_payload + crc_bytes + EOF
+    # Tile the pattern straight into the frame buffer and seal it there:
+    # no separate big payload object, and no second copy into the frame.
+    pattern = payload or _FILLER
+    step = len(pattern)
+    frame = bytearray(target_length + 6)
+    with memoryview(frame) as view:
+        for offset in range(3, target_length + 3, step):
+            chunk = min(step, target_length + 3 - offset)
+            view[offset:offset + chunk] = pattern[:chunk]
+    return seal_frame(frame)
 
 
 # ---------- Utilities ----------
-def list_available_ports():
-    ports = serial.tools.list_ports.comports()
-    return [p.device for p in ports]
-
-
-def select_port():
-    while True:
-        ports = list_available_ports()
-        log_message(f"Detected {len(ports)} COM port(s): {ports}")
-        print("\n=== Available COM ports ===")
-        if not ports:
-            print("  (none detected)")
-        else:
-            for i, port in enumerate(ports, start=1):
-                print(f"  {i}. {port}")
-        print("\n  0. 🔄 Refresh list\n  q. ❌ Quit")
-        choice = input("\nSelect a port number: ").strip().lower()
-        if choice == "q":
-            log_message("User quit port selection.")
-            return None
-        if choice == "0":
-            continue
-        try:
-            idx = int(choice)
-            if 1 <= idx <= len(ports):
-                log_message(f"User selected port: {ports[idx-1]}")
-                return ports[idx-1]
-            else:
-                print("Invalid selection. Try again.")
-        except ValueError:
-            print("Please enter a valid number.")
-
-
-def open_serial_connection(port, baudrate=BAUDRATE, timeout=TIMEOUT):
-    try:
-        ser = serial.Serial(port, baudrate=baudrate, timeout=timeout)
-        print(f"\n✅ Connected to {port} at {baudrate} baud.")
-        log_message(f"Connected to {port} at {baudrate} baud.")
-        return ser
-    except serial.SerialException as e:
-        print(f"\n❌ Failed to open port {port}: {e}")
-        log_message(f"Failed to open port {port}: {e}")
-        return None
+# Reused across calls; not thread-safe.
+_DATA_MSG = uart_pb2.UartMessage()
 
 
 def build_data_message(text: str) -> bytes:
-    msg = uart_pb2.UartMessage()
-    msg.data_message.timestamp = int(time() * 1000)
+    msg = _DATA_MSG
+    msg.Clear()
+    msg.data_message.timestamp = time_ns() // 1_000_000
     msg.data_message.data = text
-    log_message(f"Built DataMessage for test payload length={len(msg.SerializeToString())}")
-    return msg.SerializeToString()
+    serialized = msg.SerializeToString()
+    log_message(f"Built DataMessage for test payload length={len(serialized)}")
+    return serialized
 
 
-def send_and_report(ser, framed: bytes, note: str = ""):
+def send_and_report(ser, framed: bytes, note: str = "", burst: int = 1):
+    """Send `framed` `burst` times back to back in a single write."""
+    import serial  # already loaded once a port is open
+
     try:
-        ser.write(framed)
-        print(f"Sent {len(framed)} bytes. {note}")
-        log_message(f"Sent test frame: {note} ({len(framed)} bytes)")
+        if burst > 1:
+            sent = send_batch(ser, [framed] * burst)
+            note = f"{note} (x{burst})"
+        else:
+            write_frame(ser, framed)
+            sent = len(framed)
+        print(f"Sent {sent} bytes. {note}")
+        log_message(f"Sent test frame: {note} ({sent} bytes)")
     except serial.SerialException as e:
         print(f"Serial write error: {e}")
         log_message(f"Serial write error: {e}")
 
 
 # ---------- Test menu ----------
-def test_menu(ser):
-    """
-    Interactive menu for sending malformed frames.
-    Each test sends one frame by default; user can repeat as needed.
-    """
-    menu = """
+_TEST_MENU = """
 === UART Test Menu ===
 1) SOF missing
 2) EOF missing
@@ -195,64 +133,95 @@ def test_menu(ser):
 r) Send a VALID (control) message
 q) Quit test menu
 Enter choice: """
+
+# Default payload text for the malformed-frame tests: test_<choice>_<ms timestamp>
+_DEFAULT_TEXT_FMT = "test_{}_{}"
+
+# Report label for each malformed-frame test
+_NOTES = {
+    "1": "SOF missing",
+    "2": "EOF missing",
+    "3": "wrong length field",
+    "4": "wrong CRC",
+    "5": "payload length mismatch",
+    "6": "payload too high (600 bytes)",
+}
+
+# Frame builder for each single-argument test (test 6 needs an extra prompt)
+_BUILDERS = {
+    "1": frame_missing_sof,
+    "2": frame_missing_eof,
+    "3": frame_wrong_length_field,
+    "4": frame_wrong_crc,
+    "5": frame_payload_length_mismatch,
+}
+
+
+def test_menu(ser, burst: int = 1):
+    """
+    Interactive menu for sending malformed frames.
+    Each test sends one frame by default (or `burst` copies in one write);
+    user can repeat as needed.
+    """
     while True:
-        choice = input(menu).strip().lower()
+        choice = input(_TEST_MENU).strip().lower()
         if choice == "q":
             log_message("Exiting test menu.")
             break
         if choice == "r":
             text = input("Enter text to send in a VALID frame (or enter for default): ").strip()
             if not text:
-                text = f"control-{int(time()*1000)}"
+                text = f"control-{time_ns() // 1_000_000}"
             payload = build_data_message(text)
             framed = frame_message(payload)
-            send_and_report(ser, framed, "VALID frame")
+            send_and_report(ser, framed, "VALID frame", burst)
             continue
 
-        if choice not in {"1", "2", "3", "4", "5", "6"}:
+        if choice not in _NOTES:
             print("Invalid choice.")
             continue
 
         # Use a short default text payload for tests to make interpretation easier on ESP
-        default_text = f"test_{choice}_{int(time()*1000)}"
+        default_text = _DEFAULT_TEXT_FMT.format(choice, time_ns() // 1_000_000)
         base_payload = build_data_message(default_text)
 
-        if choice == "1":
-            framed = frame_missing_sof(base_payload)
-            note = "SOF missing"
-        elif choice == "2":
-            framed = frame_missing_eof(base_payload)
-            note = "EOF missing"
-        elif choice == "3":
-            framed = frame_wrong_length_field(base_payload)
-            note = "wrong length field"
-        elif choice == "4":
-            framed = frame_wrong_crc(base_payload)
-            note = "wrong CRC"
-        elif choice == "5":
-            framed = frame_payload_length_mismatch(base_payload)
-            note = "payload length mismatch"
-        elif choice == "6":
+        if choice == "6":
             # For test 6, prompt whether to craft with the protobuf repeated or filler
             sub = input("Use repeated protobuf (r) or filler (f)? [f]: ").strip().lower()
             if sub == "r":
                 framed = frame_payload_too_high(base_payload, target_length=600)
             else:
                 framed = frame_payload_too_high(None, target_length=600)
-            note = "payload too high (600 bytes)"
+        else:
+            framed = _BUILDERS[choice](base_payload)
 
-        send_and_report(ser, framed, note)
+        note = _NOTES[choice]
+        send_and_report(ser, framed, note, burst)
 
         # Optionally allow repeated sends
         rep = input("Send same test again? (y/N): ").strip().lower()
         if rep == "y":
             try:
-                send_and_report(ser, framed, note + " (repeat)")
+                send_and_report(ser, framed, note + " (repeat)", burst)
             except Exception:
                 pass
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Send malformed UART frames to the ESP32.")
+    parser.add_argument(
+        "--burst", type=int, default=1, metavar="N",
+        help="send each test frame N times back to back in a single write (default: 1)",
+    )
+    args = parser.parse_args()
+    if args.burst < 1:
+        parser.error("--burst must be at least 1")
+    return args
+
+
 def main():
+    args = parse_args()
+    configure_console_logging()
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     print("=====================================")
     print("Project name: pc_uart_proto (test menu)")
@@ -275,7 +244,7 @@ def main():
             continue
 
     # Open the test menu after connecting
-    test_menu(ser)
+    test_menu(ser, args.burst)
 
     ser.close()
     print("🔌 Connection closed.")
@@ -14,11 +14,115 @@ Author: Blaž Truden
 Date: 2025-10-05
 """
 
-from datetime import datetime
+import atexit
 import os
+import queue
+import threading
+import time
 
 DEFAULT_LOG_FILE = "log.txt"
 
+# Last formatted timestamp, reused for every entry logged within the same second
+_last_second = None
+_last_timestamp = ""
+
+
+def _timestamp() -> str:
+    """
+    Return the current local time formatted as YYYY-MM-DD HH:MM:SS.
+
+    The string is only rebuilt when the wall-clock second changes, so
+    bursts of log calls share a single strftime() call.
+    """
+    global _last_second, _last_timestamp
+    now = int(time.time())
+    if now != _last_second:
+        _last_timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now))
+        _last_second = now
+    return _last_timestamp
+
+
+# Open log file handles, keyed by path. Kept open for the lifetime of the
+# program so each entry costs a single write instead of open/write/close.
+_log_files = {}
+
+
+def _get_log_file(log_file: str):
+    """
+    Return the cached handle for `log_file`, opening it on first use.
+
+    Files are opened line-buffered so every entry reaches the disk as soon
+    as it is written, just like with the previous open-per-call approach.
+    """
+    lf = _log_files.get(log_file)
+    if lf is None:
+        lf = open(log_file, "a", encoding="utf-8", errors="backslashreplace", buffering=1)
+        _log_files[log_file] = lf
+    return lf
+
+
+def _close_log_files():
+    """Close every cached log file handle."""
+    for lf in _log_files.values():
+        lf.close()
+    _log_files.clear()
+
+
+def _write_entry(log_file: str, entry: str):
+    """Write one formatted entry to `log_file`, reporting I/O errors on stdout."""
+    try:
+        _get_log_file(log_file).write(entry)
+    except OSError as e:
+        _log_files.pop(log_file, None)  # reopen on the next call
+        print(f"⚠️ Failed to write to log file '{log_file}': {e}")
+
+
+# Entries waiting to be written as (log_file, entry) tuples. log_message()
+# only enqueues; a daemon thread does the disk I/O so callers never block
+# on the log file.
+_log_queue = queue.Queue()
+_writer_thread = None
+_writer_lock = threading.Lock()
+
+
+def _writer_loop():
+    """
+    Drain the log queue forever, writing entries in arrival order.
+
+    A failing entry is reported and skipped; the thread must survive it,
+    otherwise _flush_log_queue() would wait forever at exit.
+    """
+    while True:
+        log_file, entry = _log_queue.get()
+        try:
+            _write_entry(log_file, entry)
+        except Exception as e:
+            print(f"⚠️ Failed to write to log file '{log_file}': {e!r}")
+        finally:
+            _log_queue.task_done()
+
+
+def _ensure_writer():
+    """Start the background writer thread on first use."""
+    global _writer_thread
+    if _writer_thread is None:
+        with _writer_lock:
+            if _writer_thread is None:
+                _writer_thread = threading.Thread(
+                    target=_writer_loop, name="log-writer", daemon=True
+                )
+                _writer_thread.start()
+
+
+def _flush_log_queue():
+    """Wait for pending entries to be written, then close the log files."""
+    if _writer_thread is not None and _writer_thread.is_alive():
+        _log_queue.join()
+    _close_log_files()
+
+
+atexit.register(_flush_log_queue)
+
 
 def log_message(text: str, log_file: str = DEFAULT_LOG_FILE):
     """
@@ -27,15 +131,12 @@ def log_message(text: str, log_file: str = DEFAULT_LOG_FILE):
     Each entry is written in the format:
         [YYYY-MM-DD HH:MM:SS] <message>
 
+    The entry is timestamped immediately but written by a background
+    thread; pending entries are flushed when the program exits.
+
     Args:
         text (str): The message text to log.
         log_file (str, optional): Path to the log file. Defaults to 'log.txt'.
     """
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    entry = f"[{timestamp}] {text}\n"
-
-    try:
-        with open(log_file, "a", encoding="utf-8") as lf:
-            lf.write(entry)
-    except OSError as e:
-        print(f"⚠️ Failed to write to log file '{log_file}': {e}")
+    _ensure_writer()
+    _log_queue.put_nowait((log_file, f"[{_timestamp()}] {text}\n"))
@@ -17,206 +17,344 @@ Author: Blaž Truden
 Date: 2025-10-04
 """
 
-import struct
-import serial
-import serial.tools.list_ports
+import logging
+import queue
+import sys
+import threading
 from datetime import datetime
-from time import time
+from time import time_ns
 from uart_proto import uart_pb2  # Generated from uart.proto
 from logger_util import log_message
+from uart_frame import (
+    MAX_MESSAGE_LENGTH,
+    configure_console_logging,
+    frame_message,
+    make_writer,
+    open_serial_connection,
+    prompt,
+    select_port,
+)
 
-# === Configuration constants ===
-BAUDRATE = 115200            # Default UART speed (bits per second)
-TIMEOUT = 1.0                # Serial read timeout (seconds)
-MAX_MESSAGE_LENGTH = 128     # Maximum allowed message length (before framing)
+log = logging.getLogger(__name__)
 
-# === Frame format configuration ===
-SOF = b'\x02'                # Start of Frame (default: STX 0x02)
-EOF = b'\x03'                # End of Frame (default: ETX 0x03)
+# === Piped input batching ===
+PIPE_READ_SIZE = 64 * 1024   # Maximum bytes taken from a stdin pipe per read
+PIPE_MAX_LINE = 4 * MAX_MESSAGE_LENGTH  # Longer unfinished lines are dropped unread
+BATCH_MAX_FRAMES = 100       # Maximum frames coalesced into one serial write
+BATCH_MAX_BYTES = 64 * 1024  # Maximum bytes coalesced into one serial write
 
+# === Background sender ===
+TX_QUEUE_SIZE = 64           # Frames/batches that may wait for the sender thread
+TX_COALESCE_BYTES = 8192     # The sender merges queued data into writes of up to this size
 
-def crc16_ibm(data: bytes) -> int:
+
+# Reused by build_data_message() instead of constructing a new message per
+# call. Not thread-safe: only build messages from the main thread.
+_DATA_MSG = uart_pb2.UartMessage()
+
+
+def build_data_message(text: str) -> bytes:
     """
-    Compute a CRC-16/IBM checksum over the given data buffer.
+    Create a serialized Protobuf DataMessage with a timestamp and text.
 
-    Polynomial: 0xA001 (reflected 0x8005)
-    Initial value: 0xFFFF
+    A single module-level UartMessage is cleared and refilled on every
+    call, so this function must not be called concurrently.
 
     Args:
-        data (bytes): Input data buffer.
+        text (str): The UTF-8 string payload entered by the user.
 
     Returns:
-        int: 16-bit CRC value.
+        bytes: Serialized Protobuf message.
     """
-    crc = 0xFFFF
-    for byte in data:
-        crc ^= byte
-        for _ in range(8):
-            if crc & 1:
-                crc = (crc >> 1) ^ 0xA001
-            else:
-                crc >>= 1
-    return crc & 0xFFFF
-
-
-def frame_message(payload: bytes) -> bytes:
+    msg = _DATA_MSG
+    msg.Clear()
+    msg.data_message.timestamp = time_ns() // 1_000_000  # milliseconds since epoch
+    msg.data_message.data = text
+    log_message(f"Built DataMessage: timestamp={msg.data_message.timestamp}, data='{text}'")
+    return msg.SerializeToString()
+
+
+def frame_user_input(user_input: str):
     """
-    Construct a framed message according to the format:
-        [SOF][length (2 bytes)][payload][CRC16][EOF]
+    Serialize and frame one line of user input.
 
     Args:
-        payload (bytes): The message payload to frame.
+        user_input (str): The stripped line entered by the user.
 
     Returns:
-        bytes: The complete framed message ready for UART transmission.
+        bytes | None: The framed message, or None if the Protobuf
+        payload exceeds MAX_MESSAGE_LENGTH (the user is told why).
     """
-    length = len(payload)
-    length_bytes = struct.pack(">H", length)  # 2 bytes, big-endian
-    crc = crc16_ibm(payload)
-    crc_bytes = struct.pack(">H", crc)
-    return SOF + length_bytes + payload + crc_bytes + EOF
+    log_message(f"User input: {user_input}")
+
+    # The serialized message always carries the text's UTF-8 bytes plus
+    # field overhead, so text that alone exceeds the limit can be rejected
+    # before building the Protobuf message. UTF-8 needs at most 4 bytes
+    # per character, so short text is known to pass without measuring;
+    # ASCII text (the usual case) is measured without encoding it.
+    n = len(user_input)
+    if n * 4 > MAX_MESSAGE_LENGTH:
+        text_size = n if user_input.isascii() else len(user_input.encode("utf-8"))
+        if text_size > MAX_MESSAGE_LENGTH:
+            log.warning("⚠️ Message too long (%d bytes of text). Limit is %d bytes.", text_size, MAX_MESSAGE_LENGTH)
+            log_message(f"Message text too long: {text_size} bytes.")
+            return None
 
+    # Serialize user input into Protobuf message
+    serialized = build_data_message(user_input)
 
-def list_available_ports():
-    """
-    Detect and return the list of available COM ports on the host system.
+    if len(serialized) > MAX_MESSAGE_LENGTH:
+        log.warning("⚠️ Protobuf message too long (%d bytes). Limit is %d bytes.", len(serialized), MAX_MESSAGE_LENGTH)
+        log_message(f"Protobuf message too long: {len(serialized)} bytes.")
+        return None
 
-    Returns:
-        list[str]: A list of port device names, e.g. ["COM3", "COM5"].
+    return frame_message(serialized)
+
+
+def _sender_loop(ser, tx_queue, send_errors):
     """
-    ports = serial.tools.list_ports.comports()
-    return [port.device for port in ports]
+    Body of the sender thread: write queued data to the port until None arrives.
 
+    Whatever is already queued behind the first item is merged into the
+    same write (up to TX_COALESCE_BYTES), so bursts of input leave as a
+    single serial write. Merging happens in one scratch buffer allocated
+    here and reused for every write; items too large for it are written
+    as they are.
 
-def select_port():
+    The first failed write is appended to `send_errors`, which tells the
+    input side to stop; anything queued after it is discarded.
     """
-    Display the list of available COM ports and prompt the user to select one.
+    import serial  # already loaded by open_serial_connection()
+
+    write = make_writer(ser)
+    scratch = bytearray(TX_COALESCE_BYTES)
+    view = memoryview(scratch)
+    held = None  # item that did not fit into the previous write
+    stopping = False
+    while not stopping:
+        first = held if held is not None else tx_queue.get()
+        held = None
+        if first is None:
+            return
+        size = len(first)
+        if size >= TX_COALESCE_BYTES:
+            data = first
+        else:
+            view[:size] = first
+            while True:
+                try:
+                    item = tx_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                end = size + len(item)
+                if end > TX_COALESCE_BYTES:
+                    held = item  # goes out first in the next write
+                    break
+                view[size:end] = item
+                size = end
+            data = view[:size]
+        if send_errors:
+            continue  # the port failed; keep draining so put() never blocks
+        try:
+            write(data)
+            log_message(f"Wrote {size} bytes to UART.")
+        except serial.SerialException as e:
+            log_message(f"Serial write error: {e}")
+            send_errors.append(e)
+        except Exception as e:
+            log_message(f"Unexpected sender error: {e!r}")
+            send_errors.append(e)
+
+
+def start_sender(ser):
+    """
+    Start the background thread that performs all UART writes.
 
-    The user can:
-        • Enter a port number to select it.
-        • Enter '0' to refresh the list.
-        • Enter 'q' to quit.
+    Input handling only puts framed bytes on the returned queue, so the
+    prompt never waits on the serial driver.
+
+    Args:
+        ser (serial.Serial): An open serial connection.
 
     Returns:
-        str | None: The selected port name, or None if the user quit.
+        tuple[queue.Queue, threading.Thread, list]: The bounded transmit
+        queue (TX_QUEUE_SIZE entries), the running sender thread and the
+        list that receives its write error, if any.
     """
-    while True:
-        ports = list_available_ports()
-        log_message(f"Detected {len(ports)} COM port(s): {ports}")
-        print("\n=== Available COM ports ===")
-        if not ports:
-            print("  (none detected)")
-        else:
-            for i, port in enumerate(ports, start=1):
-                print(f"  {i}. {port}")
+    tx_queue = queue.Queue(TX_QUEUE_SIZE)
+    send_errors = []
+    sender = threading.Thread(
+        target=_sender_loop, args=(ser, tx_queue, send_errors), name="uart-sender", daemon=True
+    )
+    sender.start()
+    return tx_queue, sender, send_errors
 
-        print("")
-        print("  0. 🔄 Refresh list")
-        print("  q. ❌ Quit")
 
-        choice = input("\nSelect a port number: ").strip().lower()
+def stop_sender(tx_queue, sender):
+    """Let the sender write everything still queued, then wait for it to exit."""
+    if sender.is_alive():  # a dead sender would never free a slot for None
+        tx_queue.put(None)
+    sender.join()
 
-        if choice == "q":
-            log_message("User quit port selection.")
-            return None
-        elif choice == "0":
-            log_message("User refreshed the port list.")
-            continue  # Refresh list and restart loop
-        else:
-            try:
-                idx = int(choice)
-                if 1 <= idx <= len(ports):
-                    log_message(f"User selected port: {ports[idx - 1]}")
-                    return ports[idx - 1]
-                else:
-                    print("Invalid selection. Try again.")
-            except ValueError:
-                print("Please enter a valid number.")
-
-
-def open_serial_connection(port, baudrate=BAUDRATE, timeout=TIMEOUT):
+
+def _sender_failed(send_errors) -> bool:
     """
-    Attempt to open a serial connection to the specified port.
+    Return True, after reporting it, if the sender thread hit a write error.
 
-    Args:
-        port (str): The name of the serial port (e.g., "COM3").
-        baudrate (int): UART baud rate in bits per second.
-        timeout (float): Read timeout in seconds.
+    Checked before every put() so that a lost port ends transmission mode
+    instead of queueing lines that will never be sent.
+    """
+    if not send_errors:
+        return False
+    log.error("⚠️ Serial error: %s", send_errors[0])
+    log_message("Exited transmission mode after a serial error.")
+    return True
 
-    Returns:
-        serial.Serial | None: An open serial connection if successful,
-        or None if the attempt failed.
+
+def _is_exit(user_input: str) -> bool:
     """
-    try:
-        ser = serial.Serial(port, baudrate=baudrate, timeout=timeout)
-        print(f"\n✅ Connected to {port} at {baudrate} baud.")
-        log_message(f"Connected to {port} at {baudrate} baud.")
-        return ser
-    except serial.SerialException as e:
-        print(f"\n❌ Failed to open port {port}: {e}")
-        log_message(f"Failed to open port {port}: {e}")
-        return None
+    Return True if the stripped input line is the 'exit' command (any case).
 
+    The length test rejects ordinary messages before lower() builds a
+    new string, so only 4-character lines pay for the comparison.
+    """
+    return len(user_input) == 4 and user_input.lower() == "exit"
 
-def build_data_message(text: str) -> bytes:
+
+def _queue_batch(tx_queue, send_errors, batch, size) -> bool:
+    """Queue a list of frames for the sender as one block; False if the sender failed."""
+    if _sender_failed(send_errors):
+        return False
+    log_message(f"Queueing batch of {len(batch)} framed message(s), {size} bytes.")
+    tx_queue.put(b"".join(batch))
+    log.info("📤 Queued %d bytes (%d message(s)).", size, len(batch))
+    return True
+
+
+def transmit_piped_input(tx_queue, send_errors):
     """
-    Create a serialized Protobuf DataMessage with a timestamp and text.
+    Send every line of a piped (non-TTY) stdin over UART.
 
-    Args:
-        text (str): The UTF-8 string payload entered by the user.
+    stdin is drained in large chunks: each wake-up takes everything the
+    pipe has (up to PIPE_READ_SIZE bytes) with a single read1() call, and
+    all complete lines in it are framed and queued together as one block
+    (up to BATCH_MAX_FRAMES frames / BATCH_MAX_BYTES bytes per block).
+    A line still unfinished after PIPE_MAX_LINE bytes is far over the
+    message limit, so it is discarded up to its newline instead of being
+    buffered. Stops at end of input, on an 'exit' line or when a write fails.
 
-    Returns:
-        bytes: Serialized Protobuf message.
+    Args:
+        tx_queue (queue.Queue): Transmit queue from start_sender().
+        send_errors (list): Write error list from start_sender().
     """
-    msg = uart_pb2.UartMessage()
-    msg.data_message.timestamp = int(time() * 1000)  # milliseconds since epoch
-    msg.data_message.data = text
-    log_message(f"Built DataMessage: timestamp={msg.data_message.timestamp}, data='{text}'")
-    return msg.SerializeToString()
+    stdin = sys.stdin.buffer
+    encoding = sys.stdin.encoding or "utf-8"
+    pending = bytearray()  # incomplete last line of the previous chunk
+    skipping = False  # discarding the rest of an over-long line
+    while True:
+        chunk = stdin.read1(PIPE_READ_SIZE)  # blocks only until some data arrives
+        if chunk:
+            if skipping:
+                newline = chunk.find(b"\n")
+                if newline < 0:
+                    continue
+                chunk = chunk[newline + 1:]
+                skipping = False
+            pending += chunk
+            lines = pending.split(b"\n")
+            pending = lines.pop()
+            if len(pending) > PIPE_MAX_LINE:
+                log.warning("⚠️ Line too long (over %d bytes); skipped.", PIPE_MAX_LINE)
+                log_message(f"Piped line over {PIPE_MAX_LINE} bytes skipped.")
+                pending = bytearray()
+                skipping = True
+        else:
+            lines = [pending] if pending else []  # end of input
 
+        batch = []
+        size = 0
+        for raw in lines:
+            user_input = raw.decode(encoding, "replace").strip()
+            if _is_exit(user_input):
+                log_message("User exited transmission mode.")
+                chunk = b""  # stop after queueing what came before it
+                break
 
-def transmit_user_input(ser):
+            framed = frame_user_input(user_input)
+            if framed is None:
+                continue
+            batch.append(framed)
+            size += len(framed)
+            if len(batch) >= BATCH_MAX_FRAMES or size >= BATCH_MAX_BYTES:
+                if not _queue_batch(tx_queue, send_errors, batch, size):
+                    return
+                batch = []
+                size = 0
+
+        if batch and not _queue_batch(tx_queue, send_errors, batch, size):
+            return
+        if not chunk:
+            return
+
+
+def transmit_user_input(tx_queue, send_errors):
     """
     Continuously read lines from the user and send them over UART.
 
     Each line is:
         - Serialized into a Protobuf DataMessage
         - Framed as [SOF][length][payload][CRC16][EOF]
-        - Sent through the open serial port
+        - Queued for the sender thread, which writes it to the serial port
+
+    When stdin is a pipe, lines are batched by transmit_piped_input()
+    instead of being queued one at a time. Transmission mode ends if the
+    sender thread reports a write error.
 
     Args:
-        ser (serial.Serial): An open serial connection.
+        tx_queue (queue.Queue): Transmit queue from start_sender().
+        send_errors (list): Write error list from start_sender().
     """
     print("\n=== UART Transmission Mode ===")
     print(f"Type messages to send. Type 'exit' to quit.\n")
 
     try:
+        if not sys.stdin.isatty():
+            transmit_piped_input(tx_queue, send_errors)
+            return
+
         while True:
-            user_input = input("> ").strip()
-            log_message(f"User input: {user_input}")
-            if user_input.lower() == "exit":
-                print("Exiting transmission mode...")
+            line = prompt("> ")
+            if line is None:  # end of input (Ctrl-D / Ctrl-Z)
+                if log.isEnabledFor(logging.INFO):
+                    print()  # blank line only when the message shows
+                log.info("Exiting transmission mode...")
+                log_message("Input closed; exited transmission mode.")
+                break
+            user_input = line.strip()
+            if _is_exit(user_input):
+                log_message(f"User input: {user_input}")
+                log.info("Exiting transmission mode...")
                 log_message("User exited transmission mode.")
                 break
 
-            # Serialize user input into Protobuf message
-            serialized = build_data_message(user_input)
-
-            if len(serialized) > MAX_MESSAGE_LENGTH:
-                print(f"⚠️ Protobuf message too long ({len(serialized)} bytes). Limit is {MAX_MESSAGE_LENGTH} bytes.")
-                log_message(f"Protobuf message too long: {len(serialized)} bytes.")
+            framed = frame_user_input(user_input)
+            if framed is None:
                 continue
 
-            # Frame and send
-            framed = frame_message(serialized)
-            log_message(f"Sending framed message of {len(framed)} bytes.")
-            ser.write(framed)
-            print(f"📤 Sent {len(framed)} bytes (Protobuf payload size: {len(serialized)}).")
+            # Hand off to the sender thread
+            if _sender_failed(send_errors):
+                break
+            log_message(f"Queueing framed message of {len(framed)} bytes.")
+            tx_queue.put(framed)
+            log.info("📤 Queued %d bytes (Protobuf payload size: %d).", len(framed), len(framed) - 6)
 
     except KeyboardInterrupt:
-        print("\nKeyboard interrupt detected. Exiting transmission mode.")
-    except serial.SerialException as e:
-        print(f"\n⚠️ Serial error: {e}")
+        if log.isEnabledFor(logging.INFO):
+            print()
+        log.info("Keyboard interrupt detected. Exiting transmission mode.")
 
 
 def main():
@@ -227,6 +365,7 @@ def main():
     Handles COM port selection, connection, and user message transmission.
     """
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    configure_console_logging(__name__)
 
     print("=====================================")
     print("Project name: pc_uart_proto")
@@ -240,22 +379,29 @@ def main():
     while ser is None:
         selected_port = select_port()
         if selected_port is None:
-            print("Exiting program.")
+            log.info("Exiting program.")
             log_message("Program terminated.")
             return
 
         ser = open_serial_connection(selected_port)
         if ser is None:
-            print("\n⚠️ Could not open port. Please try again.")
+            if log.isEnabledFor(logging.WARNING):
+                print()
+            log.warning("⚠️ Could not open port. Please try again.")
             log_message(f"Retrying port selection after failure on {selected_port}...")
             continue  # Retry port selection
 
     # Once a connection is established
-    transmit_user_input(ser)
-
-    ser.close()
-    print("🔌 Connection closed.")
-    log_message("Program terminated.")
+    tx_queue, sender, send_errors = start_sender(ser)
+    try:
+        transmit_user_input(tx_queue, send_errors)
+    finally:
+        try:
+            stop_sender(tx_queue, sender)  # flush queued frames before closing the port
+        finally:
+            ser.close()
+            log.info("🔌 Connection closed.")
+            log_message("Program terminated.")
 
 
 if __name__ == "__main__":
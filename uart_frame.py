@@ -0,0 +1,581 @@
+"""
+UART Framing Module
+===================
+
+Shared serial-link helpers for the PC-side UART programs: CRC-16/IBM,
+message framing, COM port discovery and connection setup. Every frame
+follows the format:
+
+    [SOF][length 2 bytes][payload][CRC16][EOF]
+
+Both main.py and esp_test.py import from here, so an optimization to
+the framing path only has to be made once. pyserial is imported lazily
+inside the functions that need it, keeping it off the startup path.
+
+Author: Blaž Truden
+Date: 2026-10-15
+"""
+
+import logging
+import os
+import select
+import selectors
+import struct
+import sys
+from functools import lru_cache
+from time import monotonic
+from logger_util import log_message
+
+if os.name == "posix":
+    import fcntl
+
+log = logging.getLogger(__name__)
+
+# === Configuration constants ===
+BAUDRATE = 115200            # Default UART speed (bits per second)
+TIMEOUT = 0                  # Serial read timeout (seconds); 0 = non-blocking, see read_available()
+READ_BUDGET = 4096           # Maximum bytes returned by one read_available() call
+MAX_MESSAGE_LENGTH = 128     # Maximum allowed message length (before framing)
+PORT_CACHE_TTL = 2.0         # How long a COM port scan is reused (seconds)
+DRIVER_BUFFER_SIZE = 65536   # RX/TX driver buffer size requested on Windows (bytes)
+
+# === Frame format configuration ===
+SOF = b'\x02'                # Start of Frame (default: STX 0x02)
+EOF = b'\x03'                # End of Frame (default: ETX 0x03)
+
+
+# Optional C-accelerated CRC backend (``pip install crcmod``). CRC-16/MODBUS
+# uses the same parameters as crc16_ibm(): reflected 0x8005, init 0xFFFF.
+# It only pays off once the payload is long enough to amortize the call.
+NATIVE_CRC_MIN_LENGTH = 128
+try:
+    import crcmod._crcfunext  # noqa: F401  (pure-Python crcmod is no faster)
+    from crcmod.predefined import mkPredefinedCrcFun
+    _native_crc16_ibm = mkPredefinedCrcFun("modbus")
+except ImportError:
+    _native_crc16_ibm = None
+
+
+def _make_crc16_ibm_table() -> tuple:
+    """
+    Precompute the 256-entry lookup table for the reflected 0xA001 polynomial.
+
+    Each entry holds the CRC register after shifting one byte value
+    through the 8 bitwise steps, so the per-byte work at runtime is a
+    single table index.
+
+    Returns:
+        tuple[int, ...]: 256 16-bit table entries.
+    """
+    table = []
+    for value in range(256):
+        crc = value
+        for _ in range(8):
+            if crc & 1:
+                crc = (crc >> 1) ^ 0xA001
+            else:
+                crc >>= 1
+        table.append(crc)
+    return tuple(table)
+
+
+_CRC16_IBM_TABLE = _make_crc16_ibm_table()
+
+
+def crc16_ibm(data: bytes) -> int:
+    """
+    Compute a CRC-16/IBM checksum over the given data buffer.
+
+    Polynomial: 0xA001 (reflected 0x8005)
+    Initial value: 0xFFFF
+
+    Payloads of NATIVE_CRC_MIN_LENGTH bytes or more are handed to the
+    crcmod C extension when it is installed.
+
+    Args:
+        data (bytes): Input data buffer.
+
+    Returns:
+        int: 16-bit CRC value.
+    """
+    if _native_crc16_ibm is not None and len(data) >= NATIVE_CRC_MIN_LENGTH:
+        return _native_crc16_ibm(data)
+    crc = 0xFFFF
+    table = _CRC16_IBM_TABLE  # local lookup is faster inside the loop
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+
+@lru_cache(maxsize=MAX_MESSAGE_LENGTH + 1)
+def _frame_struct(length: int) -> struct.Struct:
+    """
+    Return the precompiled frame layout for a payload of `length` bytes.
+
+    Layout (big-endian): SOF (1) | length (2) | payload (n) | CRC16 (2) | EOF (1)
+
+    The cache holds a layout for every valid payload length
+    (0..MAX_MESSAGE_LENGTH), so varied message sizes never evict each other.
+
+    Args:
+        length (int): Payload length in bytes.
+
+    Returns:
+        struct.Struct: Compiled layout, cached per payload length.
+    """
+    return struct.Struct(f">cH{length}sHc")
+
+
+def assemble_frame(length_field: int, payload: bytes, crc: int) -> bytes:
+    """
+    Pack [SOF][length (2 bytes)][payload][CRC16][EOF] in a single struct call.
+
+    The length and CRC fields are taken as given, which lets test code
+    build deliberately malformed frames with the same layout.
+
+    Args:
+        length_field (int): Value written to the 2-byte length field.
+        payload (bytes): The message payload to frame.
+        crc (int): Value written to the 2-byte CRC field.
+
+    Returns:
+        bytes: The assembled frame.
+    """
+    return _frame_struct(len(payload)).pack(SOF, length_field, payload, crc, EOF)
+
+
+def frame_message(payload: bytes) -> bytes:
+    """
+    Construct a framed message according to the format:
+        [SOF][length (2 bytes)][payload][CRC16][EOF]
+
+    The whole frame is packed in one struct call straight into the
+    returned bytes object, with no intermediate pieces to concatenate.
+
+    Args:
+        payload (bytes): The message payload to frame.
+
+    Returns:
+        bytes: The complete framed message ready for UART transmission.
+    """
+    return assemble_frame(len(payload), payload, crc16_ibm(payload))
+
+
+# Header/trailer around a payload already in place (see seal_frame)
+_FRAME_HEADER = struct.Struct(">cH")   # [SOF][length (2 bytes)]
+_FRAME_TRAILER = struct.Struct(">Hc")  # [CRC16][EOF]
+
+
+def seal_frame(frame: bytearray) -> bytearray:
+    """
+    Complete a frame whose payload was written in place at offset 3.
+
+    `frame` must be sized payload length + 6. SOF, the length field, the
+    CRC16 of frame[3:-3] and EOF are filled in around the payload. Callers
+    that generate the payload straight into the frame buffer skip the
+    separate payload object and the copy into the frame.
+
+    Args:
+        frame (bytearray): Buffer holding the payload at frame[3:-3].
+
+    Returns:
+        bytearray: The same buffer, now a complete frame.
+    """
+    length = len(frame) - 6
+    with memoryview(frame) as view:
+        crc = crc16_ibm(view[3:3 + length])
+    _FRAME_HEADER.pack_into(frame, 0, SOF, length)
+    _FRAME_TRAILER.pack_into(frame, 3 + length, crc, EOF)
+    return frame
+
+
+# Last COM port scan: monotonic time it was taken and the device names found
+_ports_cache = {"t": None, "v": []}
+
+
+def configure_console_logging(*names):
+    """
+    Route status messages (the `logging` calls in these modules) to stdout.
+
+    Only this project's loggers are configured: the one of this module
+    plus any given in `names` (callers pass their own __name__). The root
+    logger is left alone, so third-party libraries stay quiet.
+
+    The level comes from the UART_LOG_LEVEL environment variable (e.g.
+    WARNING to mute routine status lines in scripted runs) and defaults
+    to INFO, which shows everything as before. Messages are printed
+    without any prefix so interactive output looks unchanged.
+
+    Args:
+        *names (str): Names of further loggers to send to the console.
+    """
+    level = getattr(logging, os.environ.get("UART_LOG_LEVEL", "INFO").upper(), None)
+    if not isinstance(level, int):
+        level = logging.INFO
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    for name in (__name__, *names):
+        logger = logging.getLogger(name)
+        logger.handlers[:] = [handler]  # replace, so repeated calls don't duplicate output
+        logger.setLevel(level)
+        logger.propagate = False
+
+
+def list_available_ports(force=False):
+    """
+    Detect and return the list of available COM ports on the host system.
+
+    Enumeration is slow (udev on Linux, SetupAPI on Windows), so a scan
+    is reused for PORT_CACHE_TTL seconds unless `force` is set.
+
+    Args:
+        force (bool): Rescan even if the cached result is still fresh.
+
+    Returns:
+        list[str]: A list of port device names, e.g. ["COM3", "COM5"].
+    """
+    now = monotonic()
+    scanned_at = _ports_cache["t"]
+    if force or scanned_at is None or now - scanned_at >= PORT_CACHE_TTL:
+        from serial.tools import list_ports  # deferred: loads platform backends
+        ports = list_ports.comports()
+        _ports_cache.update(t=now, v=[port.device for port in ports])
+    return list(_ports_cache["v"])
+
+
+def prompt(text: str):
+    """
+    Write `text` to stdout and read one line from stdin.
+
+    A lighter replacement for input(): no readline hook dispatch, and end
+    of input (Ctrl-D, Ctrl-Z on Windows, or a closed pipe) is reported as
+    None instead of raising EOFError.
+
+    Args:
+        text (str): The prompt to display.
+
+    Returns:
+        str | None: The line without its line ending, or None at end of input.
+    """
+    sys.stdout.write(text)
+    sys.stdout.flush()
+    if sys.stdin.isatty():
+        line = sys.stdin.readline()
+    else:
+        # Piped input is read from the binary buffer so that nothing is
+        # left behind in the text layer's read-ahead; later bulk reads of
+        # sys.stdin.buffer (see main.transmit_piped_input) then see it all.
+        line = sys.stdin.buffer.readline().decode(sys.stdin.encoding or "utf-8", "replace")
+    if not line:
+        return None
+    return line.rstrip("\r\n")
+
+
+# Fixed parts of the port selection menu
+_PORT_MENU_HEADER = "\n=== Available COM ports ===\n"
+_PORT_MENU_FOOTER = "\n  0. 🔄 Refresh list\n  q. ❌ Quit\n"
+
+
+def _quit_port_menu() -> bool:
+    """'q': leave port selection without choosing a port."""
+    log_message("User quit port selection.")
+    return True
+
+
+def _refresh_port_menu() -> bool:
+    """'0': rescan the COM ports and redraw the menu."""
+    log_message("User refreshed the port list.")
+    return False
+
+
+# Non-numeric port menu commands. Each returns True to leave the menu or
+# False to redraw it with a fresh port scan.
+_PORT_MENU_ACTIONS = {
+    "q": _quit_port_menu,
+    "0": _refresh_port_menu,
+}
+
+
+def select_port():
+    """
+    Display the list of available COM ports and prompt the user to select one.
+
+    The user can:
+        • Enter a port number to select it.
+        • Enter '0' to refresh the list.
+        • Enter 'q' (or end the input) to quit.
+
+    The list is rescanned when the menu is first shown and on '0';
+    redraws after an invalid entry reuse the cached scan (see
+    list_available_ports).
+
+    Returns:
+        str | None: The selected port name, or None if the user quit.
+    """
+    rescan = True
+    while True:
+        ports = list_available_ports(force=rescan)
+        rescan = False
+        log_message(f"Detected {len(ports)} COM port(s): {ports}")
+        # Emit the whole menu with a single write instead of one print per line
+        body = "".join(f"  {i}. {port}\n" for i, port in enumerate(ports, start=1))
+        sys.stdout.write(_PORT_MENU_HEADER + (body or "  (none detected)\n") + _PORT_MENU_FOOTER)
+        sys.stdout.flush()
+
+        choice = prompt("\nSelect a port number: ")
+        if choice is None:  # end of input: treat like 'q'
+            print()
+            log_message("Input closed during port selection.")
+            return None
+        choice = choice.strip()
+
+        # Menu commands are one or two characters; don't casefold long pastes
+        action = _PORT_MENU_ACTIONS.get(choice.lower() if len(choice) <= 2 else choice)
+        if action is not None:
+            if action():
+                return None
+            rescan = True
+            continue  # Refresh list and restart loop
+        elif choice.isdecimal():  # validate up front instead of catching ValueError
+            # More digits than the port count has can't be a listed port; the
+            # length check also keeps int() clear of its digit-count limit
+            idx = int(choice) if len(choice) <= len(str(len(ports))) else 0
+            if 1 <= idx <= len(ports):
+                log_message(f"User selected port: {ports[idx - 1]}")
+                return ports[idx - 1]
+            else:
+                print("Invalid selection. Try again.")
+        else:
+            print("Please enter a valid number.")
+
+
+def enable_low_latency(ser):
+    """
+    Best-effort switch of the serial driver to low-latency operation.
+
+    USB-serial drivers hold back small writes to coalesce them (16 ms by
+    default for FTDI adapters on Linux), which delays every interactive
+    frame. On Linux this sets ASYNC_LOW_LATENCY on the tty and, when the
+    adapter exposes it, lowers the USB latency_timer to 1 ms (the sysfs
+    file usually needs root or a udev rule). On Windows the driver's RX/TX
+    buffers are enlarged to DRIVER_BUFFER_SIZE instead.
+
+    Anything the platform or driver does not support is logged and skipped.
+
+    Args:
+        ser (serial.Serial): An open serial connection.
+    """
+    import serial
+
+    if os.name == "nt":
+        try:
+            ser.set_buffer_size(rx_size=DRIVER_BUFFER_SIZE, tx_size=DRIVER_BUFFER_SIZE)
+        except (serial.SerialException, OSError) as e:
+            log_message(f"Could not resize driver buffers on {ser.port}: {e}")
+        return
+
+    try:
+        ser.set_low_latency_mode(True)
+        log_message(f"Low-latency mode enabled on {ser.port}.")
+    except (NotImplementedError, ValueError) as e:
+        log_message(f"Low-latency mode not available on {ser.port}: {e}")
+
+    tty_name = os.path.basename(os.path.realpath(ser.port))
+    latency_timer = f"/sys/bus/usb-serial/devices/{tty_name}/latency_timer"
+    if os.path.exists(latency_timer):
+        try:
+            with open(latency_timer, "w") as f:
+                f.write("1")
+            log_message(f"USB latency timer of {tty_name} set to 1 ms.")
+        except OSError as e:
+            log_message(f"Could not set USB latency timer of {tty_name}: {e}")
+
+
+def open_serial_connection(port, baudrate=BAUDRATE, timeout=TIMEOUT):
+    """
+    Attempt to open a serial connection to the specified port.
+
+    On POSIX the port is opened with non-blocking writes (write_timeout=0,
+    O_NONBLOCK): write_frame() waits for the port itself, so pyserial's
+    select()-based write timeout is never engaged. Windows keeps blocking
+    writes because pyserial reuses a single OVERLAPPED structure there.
+    The driver is then switched to low-latency operation where possible
+    (see enable_low_latency).
+
+    Args:
+        port (str): The name of the serial port (e.g., "COM3").
+        baudrate (int): UART baud rate in bits per second.
+        timeout (float): Read timeout in seconds (default: non-blocking).
+
+    Returns:
+        serial.Serial | None: An open serial connection if successful,
+        or None if the attempt failed.
+    """
+    import serial  # deferred until a port is actually opened
+
+    # Raw 8N1 with no software or hardware flow control, stated explicitly
+    # so nothing on the link can pause transmission. pyserial already puts
+    # the POSIX tty in raw mode (no ICANON/ECHO/ISIG, no OPOST translation).
+    settings = dict(
+        baudrate=baudrate,
+        bytesize=serial.EIGHTBITS,
+        parity=serial.PARITY_NONE,
+        stopbits=serial.STOPBITS_ONE,
+        xonxoff=False,
+        rtscts=False,
+        dsrdtr=False,
+        timeout=timeout,
+    )
+    try:
+        if os.name == "posix":
+            ser = serial.Serial(port, write_timeout=0, **settings)
+            flags = fcntl.fcntl(ser.fileno(), fcntl.F_GETFL)
+            fcntl.fcntl(ser.fileno(), fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        else:
+            ser = serial.Serial(port, **settings)
+        enable_low_latency(ser)
+        if log.isEnabledFor(logging.INFO):
+            print()  # blank line only when the message shows
+        log.info("✅ Connected to %s at %d baud.", port, baudrate)
+        log_message(f"Connected to {port} at {baudrate} baud.")
+        return ser
+    except serial.SerialException as e:
+        if log.isEnabledFor(logging.ERROR):
+            print()
+        log.error("❌ Failed to open port %s: %s", port, e)
+        log_message(f"Failed to open port {port}: {e}")
+        return None
+
+
+def _write_fd(fd: int, data) -> None:
+    """
+    Write all of `data` to the non-blocking file descriptor `fd`.
+
+    Raises:
+        serial.SerialException: If the write fails.
+    """
+    view = memoryview(data)
+    try:
+        while view:
+            try:
+                written = os.write(fd, view)
+            except BlockingIOError:
+                select.select([], [fd], [])  # wait until the driver can take more
+                continue
+            view = view[written:]  # the kernel may accept only part of it
+    except OSError as e:
+        import serial
+        raise serial.SerialException(f"write failed: {e}") from e
+
+
+def open_read_selector(ser):
+    """
+    Create a selector that reports when `ser` has data to read.
+
+    Args:
+        ser (serial.Serial): An open serial connection.
+
+    Returns:
+        selectors.BaseSelector | None: A selector with the port registered
+        for reading, or None on platforms where serial handles cannot be
+        polled (Windows); read_available() handles both.
+    """
+    if os.name != "posix":
+        return None
+    sel = selectors.DefaultSelector()
+    sel.register(ser.fileno(), selectors.EVENT_READ)
+    return sel
+
+
+def read_available(ser, sel=None, budget=READ_BUDGET, wait=0) -> bytes:
+    """
+    Return whatever the port has received, in one chunk, without blocking.
+
+    With a selector from open_read_selector() the port is polled for up
+    to `wait` seconds and then drained with a single read of up to
+    `budget` bytes, rather than checking in_waiting (slow on Windows) or
+    reading byte by byte. Without a selector this relies on the port
+    having been opened non-blocking (timeout=0, the default).
+
+    Args:
+        ser (serial.Serial): An open serial connection.
+        sel (selectors.BaseSelector | None): Selector from open_read_selector().
+        budget (int): Maximum number of bytes to return.
+        wait (float): Seconds to wait for data when using a selector.
+
+    Returns:
+        bytes: The received bytes, or b"" if nothing was waiting.
+    """
+    if sel is not None and not sel.select(timeout=wait):
+        return b""
+    return ser.read(budget)
+
+
+def write_frame(ser, data) -> None:
+    """
+    Write `data` to the serial port in full.
+
+    On POSIX the bytes go straight to the port's non-blocking file
+    descriptor with os.write(), skipping the select() loop in pyserial's
+    write(); the call only waits when the driver's TX buffer is full.
+    Other platforms (Windows needs pyserial's overlapped I/O) use
+    ser.write().
+
+    Always use this (or a make_writer() function) instead of ser.write():
+    with non-blocking writes ser.write() may return after sending only
+    part of the data.
+
+    Args:
+        ser (serial.Serial): An open serial connection.
+        data (bytes | bytearray): The bytes to transmit.
+
+    Raises:
+        serial.SerialException: If the write fails.
+    """
+    if os.name != "posix":
+        ser.write(data)
+        return
+    _write_fd(ser.fileno(), data)
+
+
+def make_writer(ser):
+    """
+    Return a function that writes a whole buffer to `ser` like write_frame().
+
+    The platform check and the file descriptor lookup are done once here
+    rather than on every call, for loops that send many frames.
+
+    Args:
+        ser (serial.Serial): An open serial connection.
+
+    Returns:
+        Callable[[bytes | bytearray], object]: The bound write function.
+    """
+    if os.name != "posix":
+        return ser.write
+
+    fd = ser.fileno()
+
+    def write(data):
+        _write_fd(fd, data)
+
+    return write
+
+
+def send_batch(ser, frames) -> int:
+    """
+    Send several frames with a single serial write.
+
+    Joining the frames first means one driver call for the whole burst
+    instead of one per frame.
+
+    Args:
+        ser (serial.Serial): An open serial connection.
+        frames (Iterable[bytes]): Framed messages, sent back to back.
+
+    Returns:
+        int: Total number of bytes written.
+    """
+    data = b"".join(frames)
+    write_frame(ser, data)
+    return len(data)